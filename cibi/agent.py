@@ -37,22 +37,30 @@ class Agent():
             observation = env.reset()
             rng = range(max_reps) if max_reps else itertools.count()
 
+            if render:
+                # Find out whether the env can render once, not every step
+                try:
+                    env.render()
+                except NotImplementedError:
+                    render = False
+                except Exception as e:
+                    raise EnvError from e
+
+            def step_and_render(action):
+                step = env.step(action)
+                env.render()
+                return step
+
+            env_step = step_and_render if render else env.step
+
             for _ in rng:
                 self.input(observation)
-
-                if render:
-                    try:
-                        env.render()  
-                    except NotImplementedError:
-                        render = False
-                    except Exception as e:
-                        raise EnvError from e
                     
                 action = self.act()
                 prev_observation = observation
 
                 try:
-                    observation, reward, done, info = env.step(action)
+                    observation, reward, done, info = env_step(action)
                 except Exception as e:
                     raise EnvError from e
                     
@@ -11,12 +11,17 @@ Language info: https://en.wikipedia.org/wiki/Brainfuck
 
 from cibi.agent import Agent, ActionError
 from cibi.bf_io import ObservationDiscretizer, ActionSampler, DEFAULT_STEPS
-from collections import namedtuple
+from cibi.bf_core import (OP_NOOP, OP_MOVE, OP_GOTO, OP_ADD, OP_CLEAR, OP_TRANSFER,
+                          OP_NEG, OP_RANDOM, OP_SET, OP_POINT, OP_OPEN, OP_CLOSE,
+                          OP_PUSH_FRONT, OP_PUSH_BACK, OP_INPUT, TRANSFER_LENGTH,
+                          run_opcodes, randint, seed)
+from collections import namedtuple, deque
+from array import array
+import functools
 
 import numpy as np
 import time
 import itertools
-import re
 
 from typing import TYPE_CHECKING
 
@@ -82,34 +87,61 @@ DIGITS = '0123456789'
 LETTERS = 'abcdefghijklmnopqrstuvwxyz'
 DEFAULT_CMD_SET = '@><^+-[].,!~01234abcde'
 
+# Languages are read-only, so every caller can share the one for its commands
+@functools.lru_cache(maxsize=None)
 def make_bf_plus(allowed_commands=DEFAULT_CMD_SET):
   BF_INT_TO_CHAR = BF_EOS_CHAR + allowed_commands
   BF_CHAR_TO_INT = dict([(c, i) for i, c in enumerate(BF_INT_TO_CHAR)])
-  pointer_actions = LETTERS + '><'
-  memory_actions = DIGITS + '\+\-'
+  pointer_actions = frozenset(LETTERS + '><')
+  memory_actions = frozenset(DIGITS + '+-')
+  cancelling_actions = {'+': '-', '-': '+', '>': '<', '<': '>'}
+
+  # Lookup tables, so that conversions run in C.
+  # Chars outside of the alphabet translate to 0xff
+  CHAR_TO_INT_TABLE = bytearray(b'\xff' * 256)
+  for c, i in BF_CHAR_TO_INT.items():
+    CHAR_TO_INT_TABLE[ord(c)] = i
+  CHAR_TO_INT_TABLE = bytes(CHAR_TO_INT_TABLE)
+  INT_TO_CHAR_ARRAY = np.frombuffer(BF_INT_TO_CHAR.encode('ascii'), dtype=np.uint8)
 
   def bf_int_to_char(code_indices):
-    code = ''.join(BF_INT_TO_CHAR[i] for i in code_indices)
-    return code
+    # Indexes like BF_INT_TO_CHAR[i] does: negative indices count from the end,
+    # indices past it raise IndexError
+    code_indices = np.asarray(code_indices, dtype=np.intp)
+    return INT_TO_CHAR_ARRAY[code_indices].tobytes().decode('ascii')
 
   def bf_char_to_int(code):
-    code_indices = [BF_CHAR_TO_INT[c] for c in code]
-    return code_indices
-
-  def prune_step(code):
-    code = re.sub(r'\+\-|><|\-\+|<>', '', code)
-    code = re.sub(fr'[{pointer_actions}]+(?=[{LETTERS}])', '', code)
-    code = re.sub(fr'[{memory_actions}]+(?=[{DIGITS}])', '', code)
-    return code
+    # Programs can also be lists or arrays of chars
+    if not isinstance(code, str):
+      code = ''.join(code)
+    try:
+      code_indices = code.encode('ascii').translate(CHAR_TO_INT_TABLE)
+    except UnicodeEncodeError:
+      code_indices = b'\xff'
+    if b'\xff' in code_indices:
+      # Chars outside of the alphabet, raise a KeyError for the first one
+      return [BF_CHAR_TO_INT[c] for c in code]
+    return list(code_indices)
 
   def prune(code):
-    old_code = None
-    new_code = code
+    # One pass with a stack of the commands that survive so far:
+    # +- and >< cancel out, letters overwrite the pointer actions
+    # right before them and digits overwrite the memory actions
+    pruned = []
 
-    while new_code != old_code:
-      old_code, new_code = new_code, prune_step(new_code)
+    for command in code:
+      if command in LETTERS:
+        while pruned and pruned[-1] in pointer_actions:
+          pruned.pop()
+      elif command in DIGITS:
+        while pruned and pruned[-1] in memory_actions:
+          pruned.pop()
+      elif pruned and pruned[-1] == cancelling_actions.get(command):
+        pruned.pop()
+        continue
+      pruned.append(command)
 
-    return new_code
+    return ''.join(pruned)
 
   return {
     'alphabet': BF_INT_TO_CHAR,
@@ -120,20 +152,282 @@ def make_bf_plus(allowed_commands=DEFAULT_CMD_SET):
     'prune': prune
   }
 
+# Commands that always compile to the same (opcode, argument)
+CHAR_OPS = {
+  '^': (OP_GOTO, 0),
+  '~': (OP_NEG, 0),
+  '@': (OP_RANDOM, DEFAULT_STEPS),
+  '.': (OP_PUSH_FRONT, 0),
+  '!': (OP_PUSH_BACK, 0),
+  ',': (OP_INPUT, 0),
+  '[': (OP_OPEN, 0),
+  ']': (OP_CLOSE, 0)
+}
+CHAR_OPS.update((digit, (OP_SET, value)) for value, digit in enumerate(DIGITS))
+CHAR_OPS.update((letter, (OP_POINT, cell)) for cell, letter in enumerate(LETTERS))
+
+CompiledProgram = namedtuple(
+    'CompiledProgram',
+    ['op_ids', 'op_args', 'op_steps', 'op_offsets', 'bracemap', 'correct_syntax',
+     'native_ops'])
+
+def fuse_adds(code, position, alphabet):
+  """Net change of the run of +- starting at position and where it ends"""
+  delta, end = 0, position
+  while end < len(code) and code[end] in '+-' and code[end] in alphabet:
+    delta += 1 if code[end] == '+' else -1
+    end += 1
+  return delta, end
+
+def fuse_moves(code, position, alphabet):
+  """Net shift of the run of >< starting at position and where it ends"""
+  delta, lowest, end = 0, 0, position
+  while end < len(code) and code[end] in '><' and code[end] in alphabet:
+    new_delta = delta + (1 if code[end] == '>' else -1)
+    new_lowest = min(lowest, new_delta)
+    # < stops at cell 0, so the run is only equivalent to a single move
+    # if it never goes left of its starting cell or ends at its leftmost cell
+    if new_lowest not in (0, new_delta):
+      break
+    delta, lowest = new_delta, new_lowest
+    end += 1
+  return delta, end
+
+def transfer_pattern(op_ids, op_args, position):
+  """Recognize loops that add a multiple of the cell to another cell.
+
+  [->+<], [->>---<<], [>+<-] and alike move the cell's value times the
+  ADD's delta to the cell at the MOVE's offset and clear the cell.
+
+  Returns:
+    Where the MOVE to the other cell is relative to the [ (followed by the
+    ADD), or 0 if the loop at position has a different body.
+  """
+  body_ids = tuple(op_ids[position + 1:position + TRANSFER_LENGTH])
+  body_args = op_args[position + 1:position + TRANSFER_LENGTH]
+  if len(body_ids) < TRANSFER_LENGTH - 1:
+    return 0
+
+  if body_ids == (OP_ADD, OP_MOVE, OP_ADD, OP_MOVE):
+    # [->+<]
+    decrement, offset, back = body_args[0], body_args[1], body_args[3]
+    move = 2
+  elif body_ids == (OP_MOVE, OP_ADD, OP_MOVE, OP_ADD):
+    # [>+<-]
+    decrement, offset, back = body_args[3], body_args[0], body_args[2]
+    move = 1
+  else:
+    return 0
+
+  if decrement == -1 and offset != 0 and back == -offset:
+    return move
+  return 0
+
+# Programs get rerun and rewritten a lot during training, so we compile
+# each of them only once. Compiled programs are never modified,
+# so Executables can share them
+@functools.lru_cache(maxsize=2 ** 16)
+def compile_program(code, alphabet):
+  """Compile BF++ code into opcodes.
+
+  Args:
+    code: String of BF chars.
+    alphabet: Commands allowed in this language. Other chars compile to no-ops.
+
+  Returns:
+    CompiledProgram with
+    op_ids: array of opcodes.
+    op_args: array of opcode arguments: jump destinations for braces,
+        values for digits, cell positions for letters, deltas for ADD/MOVE,
+        see transfer_pattern for TRANSFER.
+    op_steps: array of how many steps of the step limit every opcode takes.
+        Fused opcodes take all their steps at once. When the step limit
+        stops a program, they have run to completion, where the unfused
+        code would have stopped halfway: the result and the actions are
+        the same, but the tape can differ.
+    op_offsets: array of positions in the code where every opcode starts,
+        followed by the length of the code.
+    bracemap: int32 array mapping every opcode index to its jump destination.
+        Braces map to their matching opcodes, everything else to itself.
+    correct_syntax: see buildbracemap.
+    native_ops: numpy views of op_ids, op_args and op_steps for run_opcodes.
+  """
+  op_ids, op_args = array('B'), array('i')
+  op_steps, op_offsets = array('i'), array('i')
+  braces = []
+
+  position = 0
+  while position < len(code):
+    command = code[position]
+    op_id, arg, end = OP_NOOP, 0, position + 1
+    # Programs skip their first char when they take their first input
+    # (see Executable.input), so it has to stay a separate opcode
+    fusable = code if position else code[:1]
+
+    if command in alphabet:
+      if command in '+-':
+        op_id = OP_ADD
+        arg, end = fuse_adds(fusable, position, alphabet)
+      elif command in '><':
+        op_id = OP_MOVE
+        arg, end = fuse_moves(fusable, position, alphabet)
+      elif fusable[position:position + 3] == '[-]' and '-' in alphabet and ']' in alphabet:
+        op_id, end = OP_CLEAR, position + 3
+      elif command in CHAR_OPS:
+        op_id, arg = CHAR_OPS[command]
+
+    op_ids.append(op_id)
+    op_args.append(arg)
+    op_steps.append(end - position if op_id in (OP_ADD, OP_MOVE) else 1)
+    op_offsets.append(position)
+    # Like in buildbracemap, every brace of the code is matched,
+    # braces outside of the alphabet are no-ops, but still jump targets
+    braces.append(command if command in '[]' and op_id != OP_CLEAR else None)
+    position = end
+  # Where the code ends, for the program finishing on its last opcode
+  op_offsets.append(len(code))
+
+  # Braces are matched in the compiled code, so that they jump between opcodes
+  jumps, correct_syntax = buildbracemap(braces)
+  # A dense array: every opcode that is not a matched brace maps to itself
+  bracemap = np.arange(len(op_ids), dtype=np.int32)
+  for position, destination in jumps.items():
+    bracemap[position] = destination
+    op_args[position] = destination
+  bracemap.flags.writeable = False
+
+  for position, destination in jumps.items():
+    if (destination == position + TRANSFER_LENGTH 
+        and op_ids[position] == OP_OPEN and op_ids[destination] == OP_CLOSE):
+      move = transfer_pattern(op_ids, op_args, position)
+      if move:
+        op_ids[position], op_args[position] = OP_TRANSFER, move
+
+  # Views of the same memory, no copies.
+  # The views also lock the arrays: array.array can't grow while it's viewed
+  native_ops = (np.frombuffer(op_ids, dtype=np.uint8),
+                np.frombuffer(op_args, dtype=np.intc),
+                np.frombuffer(op_steps, dtype=np.intc))
+  for ops in native_ops:
+    ops.flags.writeable = False
+
+  return CompiledProgram(op_ids, op_args, op_steps, op_offsets,
+                         bracemap, correct_syntax, native_ops)
+
+def _noop(*args):
+  pass
+
+def _op_noop(executable, arg):
+  pass
+
+def _op_move(executable, arg):
+  executable.cellptr = max(0, executable.cellptr + arg)
+
+def _op_goto(executable, arg):
+  # I don't trust languages without GOTO
+  goto = executable.read()
+  if goto >= 0:
+    executable.cellptr = goto
+
+# Arithmetic works on the tape in place instead of going through read() and write()
+def _op_add(executable, arg):
+  executable.ensure_enough_cells()
+  executable.cells[executable.cellptr] += arg
+
+def _op_clear(executable, arg):
+  executable.ensure_enough_cells()
+  value = executable.cells[executable.cellptr]
+  if value > 0:
+    # [-] would take 2 steps to decrement the cell by 1
+    executable.steps += 2 * int(value)
+    executable.cells[executable.cellptr] = 0
+
+def _op_transfer(executable, arg):
+  codeptr = executable.codeptr
+  value = executable.read()
+  offset = executable.op_args[codeptr + arg]
+
+  if value > 0:
+    if executable.cellptr + offset < 0:
+      # < stops at cell 0, so run the loop as it is
+      return
+
+    executable.ensure_enough_cells(max(offset, 0) + 1)
+    cells = executable.cells
+    cells[executable.cellptr + offset] += executable.op_args[codeptr + arg + 1] * value
+    cells[executable.cellptr] = 0
+    # Every iteration takes the steps of the body and the ]
+    loop_steps = executable.op_steps[codeptr + 1:codeptr + TRANSFER_LENGTH + 1]
+    executable.steps += value * sum(loop_steps)
+
+  # Go to the ], like [ does when the loop is over
+  executable.codeptr = codeptr + TRANSFER_LENGTH
+
+def _op_neg(executable, arg):
+  executable.ensure_enough_cells()
+  cells = executable.cells
+  cells[executable.cellptr] = -cells[executable.cellptr]
+
+def _op_random(executable, arg):
+  executable.write(randint(arg))
+
+def _op_set(executable, arg):
+  executable.write(arg)
+
+def _op_point(executable, arg):
+  executable.cellptr = arg
+
+def _op_open(executable, arg):
+  if executable.read() <= 0: executable.codeptr = arg
+
+def _op_close(executable, arg):
+  if executable.read() > 0: executable.codeptr = arg
+
+def _op_push_front(executable, arg):
+  executable.action_stack.appendleft(executable.read())
+
+def _op_push_back(executable, arg):
+  executable.action_stack.append(executable.read())
+
+def _op_input(executable, arg):
+  executable.state = State.AWAITING_INPUT
+  executable.record_snapshot(',')
+  # Stop here, the program can't proceed without input
+  return True
+
+# Ops that can change the tape contents (moves can only grow it)
+MUTATING_OPS = frozenset((OP_ADD, OP_CLEAR, OP_TRANSFER, OP_NEG, OP_RANDOM,
+                          OP_SET, OP_INPUT))
+
+# Indexed by opcode
+HANDLERS = (_op_noop, _op_move, _op_goto, _op_add, _op_clear, _op_transfer,
+            _op_neg, _op_random, _op_set, _op_point, _op_open, _op_close,
+            _op_push_front, _op_push_back, _op_input)
+
+# Tape cells allocated when a program starts
+INIT_CELLS = 64
+# Actions run_opcodes can buffer before returning to Python
+PUSH_BUFFER = 64
+
 class Executable(Agent):
   def __init__(self, code, observation_discretizer, action_sampler,
                language=make_bf_plus(),
                metrics={}, metadata={},
                init_memory=None, null_value=0,
                max_steps=2 ** 12, require_correct_syntax=True, debug=False,
-               cycle = False):
+               cycle = False, native=True):
     self.code = code
     self.metrics = metrics
     self.metadata = metadata
     self.alphabet = language['alphabet']
 
-    code = list(code)
-    self.bracemap, correct_syntax = buildbracemap(code)  # will modify code list
+    program = compile_program(''.join(code), self.alphabet)
+    self.op_ids, self.op_args = program.op_ids, program.op_args
+    self.op_steps, self.op_offsets = program.op_steps, program.op_offsets
+    self.bracemap = program.bracemap
+    self.native_ops = program.native_ops
+
+    correct_syntax = program.correct_syntax
     if len(code) == 0:
       # Empty programs are a very easy way for a lazy-bum developer
       # to avoid negative reinforcement for syntax errors
@@ -150,15 +444,25 @@ class Executable(Agent):
     self.debug = debug
     self.null_value = null_value
     self.cycle = cycle
+    # Traces are recorded by step(), so debugging requires the Python interpreter
+    self.native = native and not debug
+    # Outside debug mode step() shouldn't pay even for a call that checks self.debug
+    self.record_snapshot = self._record_snapshot if debug else _noop
+    self.pushes = np.empty((PUSH_BUFFER, 2), dtype=np.int64)
 
     self.init()
 
   def init(self):
     self.program_trace = [] if self.debug else None
+    self.snapshot_memory = None
+    self.tape_dirty = True
     self.codeptr, self.cellptr = 0, 0
     self.steps = 0
-    self.cells = list(self.init_memory) if self.init_memory else [0]
-    self.action_stack = []
+    init_memory = list(self.init_memory) if self.init_memory else [0]
+    self.cells = np.full(max(len(init_memory), INIT_CELLS), self.null_value, dtype=np.int64)
+    self.cells[:len(init_memory)] = init_memory
+    self.cells_used = len(init_memory)
+    self.action_stack = deque()
 
     if not self.is_valid:
       self.state = State.FINISHED
@@ -167,13 +471,23 @@ class Executable(Agent):
       self.state = State.NOT_STARTED
       self.result = None
 
-  def record_snapshot(self, command):
-    if self.debug:
-      # Add step to program trace.
-      self.program_trace.append(ExecutionSnapshot(
-          codeptr=self.codeptr, codechar=command, memptr=self.cellptr,
-          memval=self.read(), memory=list(self.cells),
-          state=self.state, action_stack=self.action_stack.copy()))
+  def _record_snapshot(self, command):
+    # Add step to program trace.
+    # Snapshots point to the code, not to the compiled opcodes
+    codeptr = self.op_offsets[self.codeptr] if self.codeptr >= 0 else self.codeptr
+    memval = self.read()
+
+    # Consecutive snapshots share the memory list until the tape changes
+    memory = self.snapshot_memory
+    if self.tape_dirty or len(memory) != self.cells_used:
+      memory = self.snapshot_memory = self.memory()
+    # Inputs write to the tape, so do the ops in MUTATING_OPS
+    self.tape_dirty = command == ',' or self.op_ids[self.codeptr] in MUTATING_OPS
+
+    self.program_trace.append(ExecutionSnapshot(
+        codeptr=codeptr, codechar=command, memptr=self.cellptr,
+        memval=memval, memory=memory,
+        state=self.state, action_stack=list(self.action_stack)))
 
   def done(self):
     if self.state != State.FINISHED:
@@ -181,25 +495,34 @@ class Executable(Agent):
       self.result = Result.KILLED
 
   def ensure_enough_cells(self, cells_required=1):
-    cell_shortage = self.cellptr + cells_required - len(self.cells)
-    if cell_shortage > 0:
-      self.cells.extend(self.null_value for i in range(cell_shortage))
+    cells_used = self.cellptr + cells_required
+    if cells_used > self.cells_used:
+      self.cells_used = cells_used
+
+      if cells_used > len(self.cells):
+        # Double the tape, so that it only has to grow a few times
+        cell_shortage = max(cells_used, 2 * len(self.cells)) - len(self.cells)
+        self.cells = np.concatenate([self.cells,
+                                     np.full(cell_shortage, self.null_value, dtype=np.int64)])
+
+  def memory(self):
+    """The part of the tape the program has used"""
+    return self.cells[:self.cells_used].tolist()
 
   def read(self):
     self.ensure_enough_cells()
-    return self.cells[self.cellptr]
+    return int(self.cells[self.cellptr])
 
   def write(self, value):
     try:
-      value = [int(value)]
+      value = int(value)
     except (TypeError, ValueError):
-      value = [int(number) for number in value]
-
-    self.ensure_enough_cells(len(value))
-    writeptr = self.cellptr
-    for number in value:
-      self.cells[writeptr] = number
-      writeptr += 1
+      value = np.asarray(value).reshape(-1).astype(np.int64)
+      self.ensure_enough_cells(len(value))
+      self.cells[self.cellptr:self.cellptr + len(value)] = value
+    else:
+      self.ensure_enough_cells()
+      self.cells[self.cellptr] = value
 
   def step(self):
     if self.state == State.FINISHED:
@@ -209,12 +532,7 @@ class Executable(Agent):
 
     self.state = State.EXECUTING
 
-    if self.max_steps is not None and self.steps >= self.max_steps:
-      self.result = Result.STEP_LIMIT
-      self.state = State.FINISHED
-      return
-
-    if self.codeptr == len(self.code):
+    if self.codeptr == len(self.op_ids):
       if self.cycle:
         self.codeptr = -1
         self.state = State.AWAITING_INPUT
@@ -225,64 +543,47 @@ class Executable(Agent):
         self.result = Result.SUCCESS
         return
 
-    command = self.code[self.codeptr]
-    self.record_snapshot(command)
-
-    if command in self.alphabet:
-      if command == '>':
-        self.cellptr += 1
-
-      if command == '<':
-        self.cellptr = 0 if self.cellptr <= 0 else self.cellptr - 1
-
-      if command == '^':
-        # I don't trust languages without GOTO
-        goto = int(self.read())
-        if goto >= 0:
-          self.cellptr = goto
-
-      if command == '+':
-        value = self.read()
-        value += 1
-        self.write(value)
-
-      if command == '-':
-        value = self.read()
-        value -= 1
-        self.write(value)
-
-      if command == '~':
-        value = self.read()
-        value = -value
-        self.write(value) 
-
-      if command == '@':
-        self.write(np.random.randint(DEFAULT_STEPS))
-
-      if command in DIGITS:
-        self.write(DIGITS.index(command))
-
-      if command in LETTERS:
-        self.cellptr = LETTERS.index(command)
+    codeptr = self.codeptr
+    self.record_snapshot(self.code[self.op_offsets[codeptr]])
 
-      if command == '[' and self.read() <= 0: self.codeptr = self.bracemap[self.codeptr]
-      if command == ']' and self.read() > 0: self.codeptr = self.bracemap[self.codeptr]
-
-      if command == '.': self.action_stack.insert(0, self.read())
-      if command == '!': self.action_stack.append(self.read())
-
-      if command == ',':
-        self.state = State.AWAITING_INPUT
-        self.record_snapshot(command)
-        return
+    if HANDLERS[self.op_ids[codeptr]](self, self.op_args[codeptr]):
+      return
 
     self.codeptr += 1
-    self.steps += 1
+    self.steps += self.op_steps[codeptr]
+
+  def execute_natively(self):
+    max_steps = -1 if self.max_steps is None else self.max_steps
+    (self.codeptr, self.cellptr, self.steps, self.cells_used,
+     push_count) = run_opcodes(*self.native_ops, self.cells, self.cells_used,
+                               self.codeptr, self.cellptr, self.steps,
+                               max_steps, self.pushes)
+
+    for value, pushed_back in self.pushes[:push_count].tolist():
+      if pushed_back:
+        self.action_stack.append(value)
+      else:
+        self.action_stack.appendleft(value)
 
   def execute(self):
-    self.step()
+    # step() itself doesn't check the step budget, the loop below does
+    max_steps = float('inf') if self.max_steps is None else self.max_steps
+
+    if self.state == State.FINISHED:
+      raise ProgramFinishedError(self.code, self.result)
+    if self.state == State.AWAITING_INPUT:
+      return
+
+    self.state = State.EXECUTING
 
     while self.state == State.EXECUTING:
+      if self.native:
+        # Native code stops where step() has to take over
+        self.execute_natively()
+      if self.steps >= max_steps:
+        self.result = Result.STEP_LIMIT
+        self.state = State.FINISHED
+        return
       self.step()
 
   def input(self, inp):
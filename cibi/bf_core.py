@@ -0,0 +1,133 @@
+"""Native core of the BF++ interpreter: opcodes and the Numba kernel running them.
+
+Programs are compiled into opcodes by cibi.bf.compile_program
+"""
+
+import numpy as np
+from numba import njit
+
+# Opcodes of compiled programs.
+# The code is compiled into a stream of opcodes with integer arguments,
+# so that step() does not have to parse the characters again.
+# Runs of +- and >< are fused into one ADD/MOVE opcode, [-] into CLEAR.
+# The [ of loops like [->+<] becomes TRANSFER, see bf.transfer_pattern
+(OP_NOOP, OP_MOVE, OP_GOTO, OP_ADD, OP_CLEAR, OP_TRANSFER, OP_NEG, OP_RANDOM,
+ OP_SET, OP_POINT, OP_OPEN, OP_CLOSE, OP_PUSH_FRONT, OP_PUSH_BACK,
+ OP_INPUT) = range(15)
+
+# Opcodes from the [ to the ] of a TRANSFER loop
+TRANSFER_LENGTH = 5
+
+@njit(cache=True)
+def run_opcodes(op_ids, op_args, op_steps, cells, cells_used,
+                codeptr, cellptr, steps, max_steps, pushes):
+  """Execute opcodes natively until one that needs the Python interpreter.
+
+  Stops at the end of the code, at the step limit (max_steps < 0 means no
+  limit), before input, when the tape has to grow and when pushes,
+  the buffer of actions for the action stack, is full.
+  Mutates cells and pushes, returns the new codeptr, cellptr, steps,
+  cells_used and the number of buffered actions.
+  Every action is buffered as (value, 1 if pushed with ! else 0).
+  @ draws from Numba's random generator, seed it with seed(), not np.random.seed.
+  """
+  push_count = 0
+
+  while codeptr < len(op_ids):
+    if max_steps >= 0 and steps >= max_steps:
+      break
+
+    position = codeptr
+    op_id = op_ids[codeptr]
+    arg = op_args[codeptr]
+
+    if op_id == OP_MOVE:
+      cellptr = max(0, cellptr + arg)
+    elif op_id == OP_POINT:
+      cellptr = arg
+    elif op_id == OP_INPUT:
+      break
+    elif op_id != OP_NOOP:
+      # Everything else reads the current cell
+      if cellptr >= len(cells):
+        break
+      if cellptr >= cells_used:
+        cells_used = cellptr + 1
+      value = cells[cellptr]
+
+      if op_id == OP_ADD:
+        cells[cellptr] = value + arg
+      elif op_id == OP_CLEAR:
+        if value > 0:
+          steps += 2 * value
+          cells[cellptr] = 0
+      elif op_id == OP_TRANSFER:
+        target = cellptr + op_args[codeptr + arg]
+        if value <= 0:
+          codeptr += TRANSFER_LENGTH
+        elif target >= len(cells):
+          break
+        elif target >= 0:
+          # Otherwise the loop runs as it is, like in _op_transfer
+          if target >= cells_used:
+            cells_used = target + 1
+          cells[target] += op_args[codeptr + arg + 1] * value
+          cells[cellptr] = 0
+          loop_steps = 0
+          for body in range(codeptr + 1, codeptr + TRANSFER_LENGTH + 1):
+            loop_steps += op_steps[body]
+          steps += value * loop_steps
+          codeptr += TRANSFER_LENGTH
+      elif op_id == OP_NEG:
+        cells[cellptr] = -value
+      elif op_id == OP_RANDOM:
+        cells[cellptr] = np.random.randint(arg)
+      elif op_id == OP_SET:
+        cells[cellptr] = arg
+      elif op_id == OP_GOTO:
+        if value >= 0:
+          cellptr = value
+      elif op_id == OP_OPEN:
+        if value <= 0:
+          codeptr = arg
+      elif op_id == OP_CLOSE:
+        if value > 0:
+          codeptr = arg
+      else:
+        if push_count == len(pushes):
+          break
+        pushes[push_count, 0] = value
+        pushes[push_count, 1] = op_id == OP_PUSH_BACK
+        push_count += 1
+
+    codeptr += 1
+    steps += op_steps[position]
+
+  return codeptr, cellptr, steps, cells_used, push_count
+
+@njit(cache=True)
+def seed(n):
+  """Seed the random generator of @, which np.random.seed doesn't reach"""
+  np.random.seed(n)
+
+@njit(cache=True)
+def randint(high):
+  """Draw from the generator of @, so that Python steps share it with run_opcodes"""
+  return np.random.randint(high)
+
+def _warm_up():
+  # Same argument types as Executable.execute_natively,
+  # so that this is the specialization programs run with
+  op_ids = np.array([OP_ADD, OP_PUSH_BACK], dtype=np.uint8)
+  op_args = np.array([1, 0], dtype=np.intc)
+  op_steps = np.ones(2, dtype=np.intc)
+  for ops in (op_ids, op_args, op_steps):
+    ops.flags.writeable = False
+  cells = np.zeros(1, dtype=np.int64)
+  pushes = np.empty((1, 2), dtype=np.int64)
+  run_opcodes(op_ids, op_args, op_steps, cells, 1, 0, 0, 0, -1, pushes)
+  randint(1)
+
+# Compile run_opcodes (or load it from the Numba cache) on import,
+# instead of in the middle of the first program
+_warm_up()
@@ -74,16 +74,18 @@ def burn_in(env, agent, observation_discretizer, action_sampler):
 
 class ObservationDiscretizer():
   def __init__(self, observation_space, history_length, thresholds=None, debug=False, force_fluid=False):
-    thresholds = np.array(thresholds)
+    self.observation_shape = observation_space.shape
+    self.feature_count = int(np.prod(self.observation_shape))
 
     if type(observation_space) == s.Box:
-      if thresholds:
+      if thresholds is not None:
+        thresholds = np.asarray(thresholds)
         if len(thresholds.shape) == 1:
           self.discretizers = [StreamDiscretizer(thresholds) 
-                               for _ in range(observation_space.shape[0])]
+                               for _ in range(self.feature_count)]
         else:
           assert thresholds.shape[:-1] == observation_space.shape
-          self.discretizers = [StreamDiscretizer(t) for t in thresholds.reshape(-1)]
+          self.discretizers = [StreamDiscretizer(t) for t in thresholds.reshape(-1, thresholds.shape[-1])]
       else:
         self.discretizers = []
 
@@ -111,13 +113,39 @@ class ObservationDiscretizer():
       msg = f'{type(observation_space)} observation spaces not supported'
       raise NotImplementedError(msg)
 
+    # If all features are discretized with the same thresholds,
+    # the whole observation can be discretized with one searchsorted
+    self.shared_thresholds = None
+    # Otherwise, if every feature has as many increasing thresholds,
+    # all features can be compared to their thresholds at once
+    self.feature_thresholds = None
+    if self.discretizers and all(type(d) == StreamDiscretizer for d in self.discretizers):
+      shared_thresholds = np.ascontiguousarray(self.discretizers[0].thresholds)
+      # digitize is searchsorted for increasing thresholds
+      if (np.all(np.diff(shared_thresholds) >= 0) 
+          and all(np.array_equal(d.thresholds, shared_thresholds) for d in self.discretizers)):
+        self.shared_thresholds = shared_thresholds
+      elif len(set(len(d.thresholds) for d in self.discretizers)) == 1:
+        feature_thresholds = np.array([d.thresholds for d in self.discretizers], dtype=np.float64)
+        if np.all(np.diff(feature_thresholds, axis=1) >= 0):
+          self.feature_thresholds = feature_thresholds
+
     if debug:
       self.trace = []
 
     self.debug = debug
 
   def discretize(self, observation):
-    if self.discretizers:
+    if self.shared_thresholds is not None:
+      observation = np.asarray(observation)
+      discretized = np.searchsorted(self.shared_thresholds, observation.ravel(), side='right')
+      discretized = discretized.reshape(observation.shape)
+    elif self.feature_thresholds is not None:
+      observation = np.asarray(observation)
+      # For increasing thresholds, digitize counts the thresholds <= value
+      discretized = (observation.reshape(-1, 1) >= self.feature_thresholds).sum(axis=1)
+      discretized = discretized.reshape(observation.shape)
+    elif self.discretizers:
       observation = np.array(observation)
       discretized = [_discretize(feature) for _discretize, feature in zip(self.discretizers, observation.reshape(-1))]
       discretized = np.array(discretized).reshape(observation.shape)    
@@ -142,6 +170,12 @@ class ObservationDiscretizer():
   def __call__(self, observation):
     return self.discretize(observation)
 
+def _pop_n(stack, n):
+  """Like pop(), but for many elements, returned in the order of the stack"""
+  popped = [stack.pop() for _ in range(n)]
+  popped.reverse()
+  return np.array(popped, dtype=np.int64)
+
 class ActionSampler:
   def __init__(self, action_space, discretization_steps=DEFAULT_STEPS, default_action=None, debug=False):
     space_type = type(action_space)
@@ -186,57 +220,84 @@ class ActionSampler:
       self.upper_bound = action_space.high
       self.bounded_above = action_space.bounded_above
       self.bounded_below = action_space.bounded_below
-      self.default_action = np.zeros(self.sample_shape, dtype=np.float)
+      self.default_action = np.zeros(self.sample_shape, dtype=np.float64)
 
     else:
       raise NotImplementedError('Only Discrete, MultiDiscrete, MultiBinary and Box spaces are supported')
 
-    self.lower_bound = self.lower_bound.reshape(-1)
-    self.upper_bound = self.upper_bound.reshape(-1)
-    self.bounded_below = self.bounded_below.reshape(-1)
-    self.bounded_above = self.bounded_above.reshape(-1)
+    # Flat and contiguous, undiscretize does its arithmetic in float64 anyway
+    self.lower_bound = np.ascontiguousarray(self.lower_bound.reshape(-1), dtype=np.float64)
+    self.upper_bound = np.ascontiguousarray(self.upper_bound.reshape(-1), dtype=np.float64)
+    self.bounded_below = np.ascontiguousarray(self.bounded_below.reshape(-1), dtype=bool)
+    self.bounded_above = np.ascontiguousarray(self.bounded_above.reshape(-1), dtype=bool)
+
+    # Every dimension of the action is undiscretized
+    # with one of 4 formulas, depending on its bounds
+    self.both_bounds = self.bounded_below & self.bounded_above
+    self.lower_bound_only = self.bounded_below & ~self.bounded_above
+    self.upper_bound_only = ~self.bounded_below & self.bounded_above
+    self.no_bounds = ~self.bounded_below & ~self.bounded_above
+
+    # The bounds each formula needs, sliced once
+    self.lower_bound_only_values = self.lower_bound[self.lower_bound_only]
+    self.upper_bound_only_values = self.upper_bound[self.upper_bound_only]
+    self.both_bounds_lower = self.lower_bound[self.both_bounds]
+    self.both_bounds_scale = ((self.upper_bound[self.both_bounds] - self.both_bounds_lower)
+                              / (self.discretization_steps - 1))
+
+    self.sample_size = int(np.prod(self.sample_shape))
+
+    if self.both_bounds.all():
+      # Discrete spaces and bounded boxes don't need the masks
+      self.undiscretize = self.undiscretize_bounded
 
     # Override defaults
     if default_action is not None:
       self.default_action = default_action
 
-  def undiscretize_action(self, idx, discrete_action):
+  def undiscretize(self, discrete_action):
     # See the paper for formula and explanation
     # TODO: Add link to arxiv
-    if not self.bounded_below[idx] and self.bounded_above[idx]:
-      action = discrete_action / self.discretization_steps
+    discrete_action = np.asarray(discrete_action, dtype=np.float64)
+    steps = self.discretization_steps
+    action = np.empty_like(discrete_action)
+
+    mask = self.no_bounds
+    action[mask] = discrete_action[mask] / steps
 
-    if self.bounded_below[idx] and not self.bounded_above[idx]:
-      action = discrete_action / (self.discretization_steps - 1)
-      action = self.lower_bound[idx] + np.abs(action - self.lower_bound[idx])
+    mask = self.lower_bound_only
+    lower_bound = self.lower_bound_only_values
+    action[mask] = lower_bound + np.abs(discrete_action[mask] / (steps - 1) - lower_bound)
 
-    if not self.bounded_below[idx] and self.bounded_above[idx]:
-      action = discrete_action / (self.discretization_steps - 1)
-      action = self.upper_bound[idx] + np.abs(self.upper_bound[idx] - action)
+    mask = self.upper_bound_only
+    upper_bound = self.upper_bound_only_values
+    action[mask] = upper_bound - np.abs(upper_bound - discrete_action[mask] / (steps - 1))
 
-    if self.bounded_below[idx] and self.bounded_above[idx]:
-      action = np.mod(discrete_action, self.discretization_steps) / (self.discretization_steps - 1)
-      action = self.lower_bound[idx] + action * (self.upper_bound[idx] - self.lower_bound[idx])
+    mask = self.both_bounds
+    action[mask] = (self.both_bounds_lower
+                    + np.mod(discrete_action[mask], steps) * self.both_bounds_scale)
 
     return action
 
-  def sample(self, action_stack):
-    sample_size = int(np.prod(self.sample_shape))
+  def undiscretize_bounded(self, discrete_action):
+    """undiscretize for actions bounded on both sides in every dimension"""
+    discrete_action = np.asarray(discrete_action, dtype=np.float64)
+    return (self.both_bounds_lower
+            + np.mod(discrete_action, self.discretization_steps) * self.both_bounds_scale)
 
-    # like pop(), but for many elements
+  def sample(self, action_stack):
     raw_action = None
     action = self.default_action
 
-    if len(action_stack) >= sample_size:
-      action = raw_action = action_stack[-sample_size:]
-      del action_stack[-sample_size:]
+    if len(action_stack) >= self.sample_size:
+      action = raw_action = _pop_n(action_stack, self.sample_size)
 
-      action = [self.undiscretize_action(idx, a) for idx, a in enumerate(action)]
+      action = self.undiscretize(raw_action)
       
       if self.just_a_number:
         action = int(action[0])
       else:
-        action = np.array(action).reshape(self.sample_shape)
+        action = action.reshape(self.sample_shape)
     
     if self.debug:
       self.trace.append(ActionSnapshot(action_stack=action_stack,
@@ -1,4 +1,9 @@
 import pandas as pd
+import heapq
+import itertools
+import io
+import os
+from operator import itemgetter
 
 import logging
 logger = logging.getLogger(f'cibi.{__file__}')
@@ -19,8 +24,9 @@ class Codebase():
     """
     A data structure for append-only storage of programs and their quality metrics
 
-    It's just a pandas dataframe at the moment, but makes for an easy drop-in replacement
-    with a more efficient implementation if need be
+    Commits go to a list of row dicts, which is cheap to append to.
+    The pandas dataframe is built from the rows when it's needed and then kept
+    until the next commit. A dataframe assigned to data_frame replaces the rows
     """
 
     def __init__(self, metrics=[], 
@@ -39,6 +45,12 @@ class Codebase():
 
         columns = ['code', 'count'] + metrics + metadata
         types = [object, int] + [float for m in metrics] + [object for m in metadata]
+        self.columns = columns
+        self.column_types = dict(zip(columns, types))
+
+        self._rows = []
+        self._row_index = {}
+        self._data_frame = None
 
         if self.save_file:
             try:
@@ -49,28 +61,67 @@ class Codebase():
                     cname: ctype for cname, ctype in zip(columns, types)
                 })
             except FileNotFoundError:
-                self.data_frame = None
-        else:
-            self.data_frame = None
-                
-        if self.data_frame is None:
-            self.data_frame = make_dataframe(columns=columns, 
-                                             dtypes=types, 
-                                             index_column='code' if deduplication else None)
+                pass
+            except (AssertionError, ValueError):
+                # Saved by a codebase with other columns or types.
+                # Move it aside, so that flush() doesn't overwrite the programs
+                backup_file = f'{save_file}.bak'
+                os.replace(save_file, backup_file)
+                logger.warning(f'Incompatible codebase in {save_file} moved to {backup_file}')
+
+    @property
+    def data_frame(self):
+        if self._data_frame is None:
+            if self._rows:
+                data_frame = pd.DataFrame(self._rows, index=[row['code'] for row in self._rows])
+                self._data_frame = data_frame.astype(self.column_types)
+            else:
+                self._data_frame = make_dataframe(columns=self.columns,
+                                                  dtypes=list(self.column_types.values()),
+                                                  index_column='code' if self.deduplication else None)
+        return self._data_frame
+
+    @data_frame.setter
+    def data_frame(self, data_frame):
+        self._data_frame = data_frame
+        # Rows are rebuilt from the dataframe by the next commit
+        self._rows = None
+
+    def _set_rows(self, rows):
+        self._rows = rows
+        self._row_index = {}
+        for row in rows:
+            self._row_index.setdefault(row['code'], row)
+        self._data_frame = None
+
+    def _get_rows(self):
+        if self._rows is None:
+            data_frame = self._data_frame
+            self._set_rows(data_frame.to_dict(orient='records'))
+            self._data_frame = data_frame
+        return self._rows
 
     def commit(self, code, metrics={}, metadata={}, count=1):
+        rows = self._get_rows()
+        # The dataframe is out of date now
+        self._data_frame = None
+
         def append_row(row_count):
             new_row = {
                 'code': code,
                 'count': row_count,
+                **{column: float('nan') for column in self.metrics + self.metadata},
                 **metrics,
                 **metadata
             }
-            self.data_frame = self.data_frame.append(pd.Series(name=code,data=new_row))
+            rows.append(new_row)
+            self._row_index.setdefault(code, new_row)
 
         if self.deduplication:
-            try:
-                program_row = self.data_frame.loc[code]
+            program_row = self._row_index.get(code)
+            if program_row is None:
+                append_row(count)
+            else:
                 program_count = program_row['count']
 
                 for metric in self.metrics:
@@ -94,10 +145,6 @@ class Codebase():
                             program_row[metadata_column] = metadata[metadata_column]
                     except KeyError:
                         pass
-
-                self.data_frame.loc[code] = program_row
-            except KeyError:
-                append_row(count)
         else:    
             for x in range(count):
                 append_row(1)
@@ -138,6 +185,7 @@ class Codebase():
 
         for code, data in other_codebase.data_frame.iterrows():
             self.data_frame.replace(self.data_frame['code'] == code, data, inplace=True)
+        self._rows = None
 
     def subset(self, codes):
         subcodebase = make_codebase_like(self)
@@ -148,7 +196,18 @@ class Codebase():
         assert metric in self.metrics, f'{metric} column not present in this codebase'
 
         sampled_codebase = make_codebase_like(self)
-        sampled_codebase.data_frame = self.data_frame.nlargest(k, metric)
+        if self._rows is None:
+            sampled_codebase.data_frame = self.data_frame.nlargest(k, metric)
+        else:
+            # Keeps the same rows as nlargest: the first of tied rows,
+            # and NaNs only if there are fewer than k numbers.
+            # Their order may differ. No dataframe of the whole codebase is built
+            rows = [row for row in self._rows if row[metric] == row[metric]]
+            top_rows = heapq.nlargest(k, rows, key=itemgetter(metric))
+            if len(top_rows) < k:
+                nan_rows = (row for row in self._rows if row[metric] != row[metric])
+                top_rows.extend(itertools.islice(nan_rows, k - len(top_rows)))
+            sampled_codebase._set_rows([dict(row) for row in top_rows])
         return sampled_codebase
 
     def __getitem__(self, column):
@@ -156,12 +215,16 @@ class Codebase():
 
     def __setitem__(self, column, value):
         self.data_frame[column] = value
+        self._rows = None
 
     def __len__(self):
-        return len(self.data_frame.index)
+        if self._rows is not None:
+            return len(self._rows)
+        return len(self._data_frame.index)
 
     def clear(self):
-        self.data_frame = self.data_frame.iloc[0:0]
+        self._rows, self._row_index = [], {}
+        self._data_frame = None
 
     def sample(self, n=1, metric=None, keep_count=False):
         sample_from = self.data_frame
@@ -203,7 +266,11 @@ class Codebase():
 
     def flush(self):
         if self.save_file:
-            self.data_frame.to_pickle(self.save_file)
+            # Serialize first, so that the file is written in one go
+            buffer = io.BytesIO()
+            self.data_frame.to_pickle(buffer)
+            with open(self.save_file, 'wb') as f:
+                f.write(buffer.getbuffer())
 
 def make_dev_codebase(save_file=None):
     return Codebase(metrics=['log_prob'],
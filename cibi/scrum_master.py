@@ -31,7 +31,7 @@ class ScrumMaster(Agent):
 
         self.replay_temperature = replay_temperature
 
-        self.sprints_elapsed = 0
+        self.sprints_elapsed = sprints_elapsed
 
         self.dev_branch = make_dev_codebase()
         self.feedback_branch = make_prod_codebase(deduplication=False)
@@ -149,11 +149,15 @@ class ScrumMaster(Agent):
                                           cycle=self.cycle_programs)
         self.sprints_elapsed += 1
         
+def hire_developers(developers, language, log_dir, events_dir):
+    return [dev.hire(language, log_dir, events_dir) 
+            for dev in developers]
+
 def hire_team(developers, env, observation_discretizer, action_sampler, 
               language, log_dir, events_dir, scrum_master_args, 
-              seed_codebase=None):
-    employees = [dev.hire(language, log_dir, events_dir) 
-                 for dev in developers]
+              seed_codebase=None, employees=None):
+    if employees is None:
+        employees = hire_developers(developers, language, log_dir, events_dir)
     manager = ScrumMaster(employees, env, 
                           observation_discretizer, action_sampler,
                           seed_codebase,
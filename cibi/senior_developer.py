@@ -91,18 +91,34 @@ class SeniorDeveloper(object):
           self.reset_is_best_model = self.is_best_model.assign(False)
           self.global_best_reward_placeholder = tf.placeholder(
               tf.float64, [], name='global_best_reward_placeholder')
-          self.assign_global_best_reward_op = tf.group(
-              self.global_best_reward.assign(
-                  self.global_best_reward_placeholder),
-              self.is_best_model.assign(True))
+          # Compare and assign in one graph run.
+          # The assignments must be created inside the branch to be conditional
+          def _assign_best_reward():
+            with tf.control_dependencies([
+                self.global_best_reward.assign(
+                    self.global_best_reward_placeholder),
+                self.is_best_model.assign(True)]):
+              return tf.constant(True)
+          self.maybe_assign_global_best_reward_op = tf.cond(
+              tf.greater(self.global_best_reward_placeholder,
+                         self.global_best_reward),
+              _assign_best_reward,
+              lambda: tf.constant(False))
+          # Whichever side of the assignment it reads, this is the new best
+          self.new_global_best_reward = tf.maximum(
+              self.global_best_reward_placeholder, self.global_best_reward)
           def assign_global_best_reward_fn(session, reward):
             reward = round(reward, 10)
-            best_reward = round(session.run(self.global_best_reward), 10)
-            is_best = reward > best_reward
-            if is_best:
-              session.run(self.assign_global_best_reward_op,
-                          {self.global_best_reward_placeholder: reward})
-            return is_best
+            # Only this function assigns global_best_reward,
+            # so once it is cached, only new bests need the graph
+            if self.cached_best_reward is not None and reward <= self.cached_best_reward:
+              return False
+            is_best, best_reward = session.run(
+                [self.maybe_assign_global_best_reward_op,
+                 self.new_global_best_reward],
+                {self.global_best_reward_placeholder: reward})
+            self.cached_best_reward = round(best_reward, 10)
+            return bool(is_best)
           self.assign_global_best_reward_fn = assign_global_best_reward_fn
 
           self.run_number = make_initialized_variable(
@@ -154,11 +170,20 @@ class SeniorDeveloper(object):
                               tf.get_variable_scope().name))
 
       self.local_step = 0
-      self.last_summary_time = time.time()
+      self.last_summary_time = time.monotonic()
       self.summary_interval = summary_interval
       self.summary_writer = summary_writer
       self.cached_global_step = -1
       self.cached_global_npe = -1
+      self.cached_best_reward = None
+      self.local_in_sync = False
+      # Summary protos are reused, see _log_reflection_result
+      self.model_summary = tf.Summary(value=[
+          tf.Summary.Value(tag='model/best_reward'),
+          tf.Summary.Value(tag='model/program_count')])
+      self.local_step_summary = tf.Summary(value=[
+          tf.Summary.Value(tag='local_step/per_sec'),
+          tf.Summary.Value(tag='local_step/step')])
 
       logger.info('summary_interval: %d', self.summary_interval)
 
@@ -172,11 +197,20 @@ class SeniorDeveloper(object):
     """Run initialization ops."""
     session.run(self.local_init_op)
     session.run(self.sync_op)
+    self.local_in_sync = True
     self.cached_global_step, self.cached_global_npe = session.run(
         [self.global_step, self.program_count])
+    # Variables may have been restored from a checkpoint
+    self.cached_best_reward = None
+
+  def _sync(self, session):
+    # Global weights only change in accept_feedback, skip the copy if they haven't
+    if not self.local_in_sync:
+      session.run(self.sync_op)  # Copy weights from global to local.
+      self.local_in_sync = True
 
   def write_programs(self, session, inspiration_branch):
-    session.run(self.sync_op)  # Copy weights from global to local.
+    self._sync(session)
 
     with session.as_default():
       return self.model.write_programs(session, inspiration_branch)
@@ -189,23 +223,16 @@ class SeniorDeveloper(object):
       if not isinstance(summaries, (tuple, list)):
         summaries = [summaries]
       summaries.append(self._local_step_summary())
-      (global_best_reward,
-        program_count) = session.run(
-            [self.global_best_reward,
-            self.program_count])
-      summaries.append(
-          tf.Summary(
-              value=[tf.Summary.Value(
-                  tag='model/best_reward',
-                  simple_value=global_best_reward)]))
-      summaries.append(
-          tf.Summary(
-              value=[tf.Summary.Value(
-                  tag='model/program_count',
-                  simple_value=program_count)]))
+      if self.cached_best_reward is None:
+        self.cached_best_reward = round(session.run(self.global_best_reward), 10)
+      # The writer copies summaries, so one proto can be reused
+      best_reward_value, program_count_value = self.model_summary.value
+      best_reward_value.simple_value = self.cached_best_reward
+      program_count_value.simple_value = reflection_result.global_npe
+      summaries.append(self.model_summary)
       for s in summaries:
         self.summary_writer.add_summary(s, global_step)
-      self.last_summary_time = time.time()
+      self.last_summary_time = time.monotonic()
 
   def accept_feedback(self, session, feedback_branch):
     """Run an update step.
@@ -220,7 +247,7 @@ class SeniorDeveloper(object):
     Args:
       session: tf.Session instance.
     """
-    session.run(self.sync_op)  # Copy weights from global to local.
+    self._sync(session)
 
     with session.as_default():
       result = self.model.accept_feedback(
@@ -228,6 +255,7 @@ class SeniorDeveloper(object):
           self.train_op, self.global_step)
       global_step = result.global_step
       global_npe = result.global_npe
+    self.local_in_sync = False
     self.cached_global_step = global_step
     self.cached_global_npe = global_npe
     self.local_step += 1
@@ -236,15 +264,13 @@ class SeniorDeveloper(object):
 
   def _local_step_summary(self):
     """Compute number of local steps per time increment."""
-    dt = time.time() - self.last_summary_time
+    # Monotonic, so that clock adjustments don't produce spikes
+    dt = max(time.monotonic() - self.last_summary_time, 1e-9)
     steps_per_time = self.summary_interval / float(dt)
-    return tf.Summary(value=[
-        tf.Summary.Value(
-            tag='local_step/per_sec',
-            simple_value=steps_per_time),
-        tf.Summary.Value(
-            tag='local_step/step',
-            simple_value=self.local_step)])
+    per_sec_value, step_value = self.local_step_summary.value
+    per_sec_value.simple_value = steps_per_time
+    step_value.simple_value = self.local_step
+    return self.local_step_summary
 
   def hire(self, language, log_dir, events_dir=None, is_chief=True):
     self.set_language(language)
@@ -11,29 +11,25 @@ from cibi.junior_developer import JuniorDeveloper
 from cibi.tester import Tester
 from cibi.lm import LanguageModel
 
+def senior_sweep():
+    lstm_sizes = [[10], [50], [256], [10,10], [50,50], [256,256]]
+    return [SeniorDeveloper({'policy_lstm_sizes': sizes}, LanguageModel, 
+                            name='senior' + '-'.join(str(size) for size in sizes))
+            for sizes in lstm_sizes]
+
+def junior_sweep():
+    return [JuniorDeveloper(indpb=1/n, name=f'junior1by{n}') for n in [3, 6, 12]]
+
+# Developers are only hired for the team that gets selected, see make_team
 teams = [
-    [SeniorDeveloper({}, LanguageModel), Tester()],
-    [SeniorDeveloper({}, LanguageModel), JuniorDeveloper(eps=0), Tester()],
-    [JuniorDeveloper(eps=0), Tester()],
-    [SeniorDeveloper({}, LanguageModel), JuniorDeveloper(), Tester()],
-    [JuniorDeveloper(), Tester()],
-    [SeniorDeveloper({'policy_lstm_sizes': [10]}, LanguageModel, name='senior10'), 
-     SeniorDeveloper({'policy_lstm_sizes': [50]}, LanguageModel, name='senior50'), 
-     SeniorDeveloper({'policy_lstm_sizes': [256]}, LanguageModel, name='senior256'),
-     SeniorDeveloper({'policy_lstm_sizes': [10,10]}, LanguageModel, name='senior10-10'), 
-     SeniorDeveloper({'policy_lstm_sizes': [50,50]}, LanguageModel, name='senior50-50'), 
-     SeniorDeveloper({'policy_lstm_sizes': [256,256]}, LanguageModel, name='senior256-256'),
-     JuniorDeveloper(indpb=1/3, name='junior1by3'),
-     JuniorDeveloper(indpb=1/6, name='junior1by6'),
-     JuniorDeveloper(indpb=1/12, name='junior1by12'),
-     Tester()],
-    [SeniorDeveloper({'policy_lstm_sizes': [10]}, LanguageModel, name='senior10'), 
-     SeniorDeveloper({'policy_lstm_sizes': [50]}, LanguageModel, name='senior50'), 
-     SeniorDeveloper({'policy_lstm_sizes': [256]}, LanguageModel, name='senior256'),
-     SeniorDeveloper({'policy_lstm_sizes': [10,10]}, LanguageModel, name='senior10-10'), 
-     SeniorDeveloper({'policy_lstm_sizes': [50,50]}, LanguageModel, name='senior50-50'), 
-     SeniorDeveloper({'policy_lstm_sizes': [256,256]}, LanguageModel, name='senior256-256'),
-     JuniorDeveloper(indpb=1/3, name='junior1by3'),
-     JuniorDeveloper(indpb=1/6, name='junior1by6'),
-     JuniorDeveloper(indpb=1/12, name='junior1by12')]
-]
\ No newline at end of file
+    lambda: [SeniorDeveloper({}, LanguageModel), Tester()],
+    lambda: [SeniorDeveloper({}, LanguageModel), JuniorDeveloper(eps=0), Tester()],
+    lambda: [JuniorDeveloper(eps=0), Tester()],
+    lambda: [SeniorDeveloper({}, LanguageModel), JuniorDeveloper(), Tester()],
+    lambda: [JuniorDeveloper(), Tester()],
+    lambda: senior_sweep() + junior_sweep() + [Tester()],
+    lambda: senior_sweep() + junior_sweep()
+]
+
+def make_team(index):
+    return teams[index]()
@@ -2,10 +2,13 @@ import click
 import inspect
 import os
 import logging
+import logging.handlers
+import atexit
 import gym
 import time
 import yaml
-import traceback
+import functools
+from concurrent.futures import ThreadPoolExecutor
 
 from importlib_metadata import version
 from evestop.generic import EVEEarlyStopping
@@ -20,27 +23,34 @@ from cibi import bf_io
 from cibi.utils import ensure_enough_test_runs, calc_hash, update_keys, trusted_version
 from cibi.codebase import make_prod_codebase
 from cibi.extensions import make_gym
-from cibi.teams import teams
-from cibi.scrum_master import hire_team
+from cibi.teams import make_team
+from cibi.scrum_master import hire_team, hire_developers
 from cibi.agent import EnvError
 
 logging.basicConfig(format='%(asctime)s %(message)s')
 logger = logging.getLogger('cibi')
 
-def make_seed_codebase(seed_file, env, observation_discretizer, action_sampler):
+# libyaml parses much faster, if PyYAML was built with it
+YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YamlDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+def make_seed_codebase(seed_file, env, observation_discretizer, action_sampler, test_config={}):
     seed_codebase = None
 
     if seed_file:
         try:
             with open(seed_file, 'r') as f:
                 seed_codebase = make_prod_codebase(deduplication=True)
-                for code in f.readlines():
+                for code in f:
                     seed_codebase.commit(code.strip(), metadata={
                         'author': 'god'
                     }, count=0)
                 logger.info('Testing programs from seed codebase')
-                ensure_enough_test_runs(seed_codebase, env, observation_discretizer, action_sampler)
-                logger.info(seed_codebase.to_string())
+                ensure_enough_test_runs(seed_codebase, env, observation_discretizer, action_sampler,
+                                        **test_config)
+                if logger.isEnabledFor(logging.INFO):
+                    # Formatting the whole codebase is expensive
+                    logger.info(seed_codebase.to_string())
                 
         except OSError as e:
             logger.error(e)
@@ -67,7 +77,7 @@ def load_summary(logdir, config_hash):
     try:
         with open(os.path.join(logdir, 'summary.yml'), 'r') as f:
             # This is an attempt to continue a previously trusted experiment
-            summary = yaml.safe_load(f)
+            summary = yaml.load(f, Loader=YamlLoader)
 
             if 'experiment' in summary and config_hash != summary['experiment']:
                 # Experiment params changed, need to start from scratch
@@ -90,14 +100,59 @@ def load_summary(logdir, config_hash):
 
     return summary
 
+def choose_test_workers(make_env, workers, probe_steps=100):
+    if workers != 'auto':
+        return workers
+
+    # Worker processes only pay off if the environment is slow,
+    # otherwise passing rewards between processes costs more than the steps.
+    # The probe gets its own env, the one used for training stays untouched
+    env = make_env()
+    try:
+        env.reset()
+        start_time = time.perf_counter()
+        for _ in range(probe_steps):
+            _, _, done, _ = env.step(env.action_space.sample())
+            if done:
+                env.reset()
+        step_time = (time.perf_counter() - start_time) / probe_steps
+    finally:
+        env.close()
+
+    workers = 1 if step_time < 1e-4 else os.cpu_count()
+    logger.info(f'{step_time:.2e} seconds per step, testing programs with {workers} workers')
+    return workers
+
+def log_burn_in_error(burn_in_done):
+    if not burn_in_done.cancelled() and burn_in_done.exception():
+        logger.error('Burn in failed', exc_info=burn_in_done.exception())
+
+def save_summary(logdir, summary):
+    # Serialize first, so that the file is written in one go
+    summary_yaml = yaml.dump(summary, Dumper=YamlDumper)
+    summary_path = os.path.join(logdir, 'summary.yml')
+    # A crash mid-write must not leave a broken summary to resume from
+    tmp_path = summary_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(summary_yaml)
+    os.replace(tmp_path, summary_path)
+
 def run_experiments(logdir, finalize_now, skip_testing):
     # PREINIT - Reading the experiment's config file
     with open(os.path.join(logdir, 'experiment.yml'), 'r') as f:
-        config = yaml.safe_load(f)
+        config = yaml.load(f, Loader=YamlLoader)
         config_hash = calc_hash(config)
 
     logger.setLevel(config.get('log_level', 'INFO'))
-    logger.addHandler(logging.FileHandler(f'{logdir}/log.log'))
+    # Write the log in batches, errors right away.
+    # The buffer is also flushed with every summary and at exit,
+    # only a killed process loses what's left in it
+    log_file = logging.FileHandler(f'{logdir}/log.log', delay=True)
+    log_buffer = logging.handlers.MemoryHandler(capacity=128,
+                                                flushLevel=logging.ERROR,
+                                                target=log_file)
+    atexit.register(log_buffer.flush)
+    logger.addHandler(log_buffer)
     logger.info(config['env'])
 
     logger.info('INIT - Understanding experiment configuration and current state')
@@ -112,9 +167,16 @@ def run_experiments(logdir, finalize_now, skip_testing):
     scrum_keys = ['cycle-programs', 'syntax-error-reward', 'replay-temperature']
     scrum_config = {key.replace('-', '_'): config[key] for key in scrum_keys if key in config}
 
-    team = teams[config['team']]
+    team = make_team(config['team'])
     env = make_gym(config['env'])
 
+    # Programs can be tested in parallel, on copies of the environment
+    make_env = functools.partial(make_gym, config['env'])
+    test_config = {
+        'workers': choose_test_workers(make_env, config.get('test-workers', 1)),
+        'make_env': make_env
+    }
+
     max_failed_sprints = config.get('max-failed-sprints', 10)
     max_sprints = config.get('max-sprints', 1000000) * len(team)
     max_sprints_without_improvement = config.get('max-sprints-without-improvement', 1000000) * len(team)
@@ -143,55 +205,95 @@ def run_experiments(logdir, finalize_now, skip_testing):
 
     random_agent = bf.Executable('@!', observation_discretizer, action_sampler, cycle=True, debug=False)
 
-    try:
-        bf_io.burn_in(env, random_agent, observation_discretizer, action_sampler)
-    except EnvError:
-        logger.error('Could not complete burn in')
-        pass
+    def burn_in():
+        try:
+            bf_io.burn_in(env, random_agent, observation_discretizer, action_sampler)
+        except EnvError:
+            logger.error('Could not complete burn in')
+            pass
+
+    # Burn in doesn't need the team, so it runs while their graphs are built.
+    # Everything that uses the env or the discretizer waits for it,
+    # result() also re-raises whatever burn in failed with
+    burn_in_executor = ThreadPoolExecutor(max_workers=1)
+    burn_in_done = burn_in_executor.submit(burn_in)
+    # Not waiting, the thread exits once burn in is done
+    burn_in_executor.shutdown(wait=False)
 
     agent = None
 
+    if summary['sprints-elapsed'] >= max_sprints and not finalize_now:
+        # Resuming a finished run, no need to hire the team and test the seed
+        logger.info('Sprint budget already spent')
+        finalize_now = True
+
     if not finalize_now:
         logger.info('TRAIN - Running many iterations of instant scrum')
 
         start_time = time.monotonic()
         start_time -= summary['seconds-elapsed']
 
-        seed_codebase = make_seed_codebase(seed, env, observation_discretizer, action_sampler)
+        try:
+            employees = hire_developers(team, language, train_dir, events_dir)
+        except BaseException:
+            # The hiring error is the one to raise, burn in's is only logged
+            burn_in_done.cancel()
+            burn_in_done.add_done_callback(log_burn_in_error)
+            raise
+        burn_in_done.result()
+
+        seed_codebase = make_seed_codebase(seed, env, observation_discretizer, action_sampler, test_config)
+
+        # The summary only holds running totals, no need to save it every sprint
+        summary_interval = config.get('summary-interval', 10)
+        episodes_since_summary = 0
+        max_episode_length = config.get('max-episode-length')
 
         failed_sprints = 0
         with hire_team(team, env, observation_discretizer, action_sampler, language,
-                    train_dir, events_dir, scrum_config, seed_codebase) as agent:
-            max_episode_length = config.get('max-episode-length')
-
-            while (agent.sprints_elapsed < max_sprints and early_stopping.proceed):
-                try:
-                    rollout = agent.attend_gym(env, max_reps=max_episode_length, render=render)
-
-                    episode_length = len(rollout)
-                    summary['shortest-episode'] = min(summary['shortest-episode'], episode_length)
-                    summary['longest-episode'] = max(summary['longest-episode'], episode_length)
-                    if summary['max-total-reward'] < rollout.total_reward:
-                        summary['max-total-reward'] = float(rollout.total_reward)
+                    train_dir, events_dir, scrum_config, seed_codebase, employees) as agent:
+            # Counters are only saved every summary-interval episodes,
+            # save them however the loop ends
+            try:
+                while (agent.sprints_elapsed < max_sprints and early_stopping.proceed):
+                    try:
+                        rollout = agent.attend_gym(env, max_reps=max_episode_length, render=render)
+
+                        episode_length = len(rollout)
+                        if episode_length < summary['shortest-episode']:
+                            summary['shortest-episode'] = episode_length
+                        if episode_length > summary['longest-episode']:
+                            summary['longest-episode'] = episode_length
+                        if summary['max-total-reward'] < rollout.total_reward:
+                            summary['max-total-reward'] = float(rollout.total_reward)
                         
-                    summary['sprints-elapsed'] = agent.sprints_elapsed
-                    summary['seconds-elapsed'] = time.monotonic() - start_time
-
-                    with open(os.path.join(logdir, 'summary.yml'), 'w') as f:
-                        yaml.dump(summary, f)
-
-                    failed_sprints = 0
-                except KeyboardInterrupt:
-                    logger.info('Keyboard interrupt received. Winding down')
-                    break
-                except EnvError as e:
-                    logger.error(traceback.format_exc())
-                    failed_sprints += 1
-                    if failed_sprints > max_failed_sprints:
-                        logger.error('Tolerance for failed sprints exceeded')
-                        raise e
+                        summary['sprints-elapsed'] = agent.sprints_elapsed
+                        summary['seconds-elapsed'] = time.monotonic() - start_time
+
+                        episodes_since_summary += 1
+                        if episodes_since_summary >= summary_interval:
+                            save_summary(logdir, summary)
+                            log_buffer.flush()
+                            episodes_since_summary = 0
+
+                        failed_sprints = 0
+                    except KeyboardInterrupt:
+                        logger.info('Keyboard interrupt received. Winding down')
+                        break
+                    except EnvError as e:
+                        logger.exception('Sprint %d failed', agent.sprints_elapsed)
+                        failed_sprints += 1
+                        if failed_sprints > max_failed_sprints:
+                            logger.error('Tolerance for failed sprints exceeded')
+                            raise e
+            finally:
+                summary['sprints-elapsed'] = agent.sprints_elapsed
+                summary['seconds-elapsed'] = time.monotonic() - start_time
+                save_summary(logdir, summary)
+                log_buffer.flush()
 
     logger.info('FINALIZE - Thoroughly testing the 100 best programs found and saving the final score')
+    burn_in_done.result()
 
     if agent:
         archive_branch = agent.archive_branch
@@ -202,7 +304,8 @@ def run_experiments(logdir, finalize_now, skip_testing):
 
     top_candidates = archive_branch.top_k('total_reward', 256)
     if not skip_testing:
-        ensure_enough_test_runs(top_candidates, env, observation_discretizer, action_sampler)
+        ensure_enough_test_runs(top_candidates, env, observation_discretizer, action_sampler,
+                                **test_config)
     top_program, top_metrics, top_metadata = top_candidates.top_k('total_reward', 1).peek()
 
     summary['top'] = {
@@ -217,8 +320,8 @@ def run_experiments(logdir, finalize_now, skip_testing):
     top_candidates.data_frame.to_pickle(os.path.join(logdir, 'top.pickle'))
 
     logger.info(f'Summary: {summary}')
-    with open(os.path.join(logdir, 'summary.yml'), 'w') as f:
-        yaml.dump(summary, f)
+    save_summary(logdir, summary)
+    log_buffer.flush()
 
 @click.command()
 @click.argument('logdir', type=str)
@@ -225,17 +225,87 @@ def parse_config_string(config_str):
       config[key] = ast.literal_eval(value)
   return config
 
-def ensure_enough_test_runs(codebase, env, observation_discretizer, action_sampler, runs=100, render=False):
+# The environment and IO of the worker processes of ensure_enough_test_runs
+_test_worker = {}
+
+def _init_test_worker(make_env, observation_discretizer, action_sampler):
+  try:
+    _test_worker['env'] = make_env()
+  except Exception as e:
+    # Pool would respawn a failing initializer forever,
+    # keep the error for _test_program to raise instead
+    _test_worker['error'] = e
+  _test_worker['observation_discretizer'] = observation_discretizer
+  _test_worker['action_sampler'] = action_sampler
+
+def _seed_env(env, seed):
+  # Newer gym versions seed through reset
+  if hasattr(env, 'seed'):
+    env.seed(seed)
+  else:
+    env.reset(seed=seed)
+
+def _test_program(test):
+  from cibi import bf
+  code, runs, render, seed = test
+
+  if 'error' in _test_worker:
+    raise _test_worker['error']
+
+  # Every test carries its own seed, so that workers don't all draw
+  # the same numbers and results don't depend on which worker ran them
+  random.seed(seed)
+  np.random.seed(seed)
+  bf.seed(seed)
+  _seed_env(_test_worker['env'], seed)
+
+  program = bf.Executable(code, _test_worker['observation_discretizer'], 
+                          _test_worker['action_sampler'], cycle=True, debug=False)
+  return [program.attend_gym(_test_worker['env'], render=render).total_reward
+          for _ in range(runs)]
+
+def ensure_enough_test_runs(codebase, env, observation_discretizer, action_sampler, runs=100, render=False,
+                            workers=1, make_env=None):
+  """Test every program of the codebase until it has been run at least runs times
+
+  With make_env, a function creating copies of env, programs are tested by
+  a pool of worker processes, each with its own environment.
+  Workers are spawned and import cibi, TensorFlow included, which takes
+  seconds: the pool only pays off when testing takes longer than that.
+  Fluid discretizers learn from every observation, and workers would
+  each update their own copy, so those are always tested sequentially
+  """
   from cibi import bf
   assert codebase.deduplication
 
-  for code, count, result in zip(codebase['code'], codebase['count'], codebase['result']):
-    try:
-      if result in ['syntax-error', 'step-limit']:
-        continue
+  tests = [(code, runs - count) 
+           for code, count, result in zip(codebase['code'], codebase['count'], codebase['result'])
+           if result not in ['syntax-error', 'step-limit'] and count < runs]
+
+  if workers > 1 and make_env and not observation_discretizer.is_fluid():
+    import multiprocessing
+
+    # Forking would copy TensorFlow's sessions and threads into the workers
+    context = multiprocessing.get_context('spawn')
+    seeds = np.random.randint(2 ** 31, size=len(tests)).tolist()
 
+    with context.Pool(workers, initializer=_init_test_worker, 
+                      initargs=(make_env, observation_discretizer, action_sampler)) as pool:
+      try:
+        # imap keeps the order of the programs, and so the order of commits
+        results = pool.imap(_test_program, [(code, test_runs, render, seed) 
+                                            for (code, test_runs), seed in zip(tests, seeds)])
+        for (code, _), total_rewards in zip(tests, results):
+          for total_reward in total_rewards:
+            codebase.commit(code, metrics={'total_reward': total_reward})
+      except KeyboardInterrupt:
+        logger.info('Testing phase cut short by KeyboardInterrupt')
+    return
+
+  for code, test_runs in tests:
+    try:
       program = bf.Executable(code, observation_discretizer, action_sampler, cycle=True, debug=False)
-      for _ in range(runs - count):
+      for _ in range(test_runs):
         rollout = program.attend_gym(env, render=render)
         codebase.commit(code, metrics={'total_reward': rollout.total_reward})
     except KeyboardInterrupt:
@@ -247,8 +317,6 @@ def calc_hash(val):
   return hashlib.sha224(str(val).encode('utf-8')).hexdigest()
 
 def retry(f, test=lambda x: True, attempts=3, exceptions=BaseException):
-  import traceback
-
   def f_with_retries(*args, **kwargs):
     result = None
 
@@ -258,7 +326,7 @@ def retry(f, test=lambda x: True, attempts=3, exceptions=BaseException):
         if test(result):
           return result
       except exceptions:
-        logger.error(traceback.format_exc())
+        logger.exception('Attempt %d failed', idx + 1)
         pass
 
     return f(*args, **kwargs)
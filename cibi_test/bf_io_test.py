@@ -0,0 +1,28 @@
+"""Tests for cibi.bf_io."""
+
+import numpy as np
+import tensorflow as tf
+import gym.spaces as s
+from cibi import bf_io
+
+class BfIoTest(tf.test.TestCase):
+
+  def testFeatureThresholds(self):
+    box = s.Box(low=-10, high=10, shape=(2, 2), dtype=np.float64)
+    thresholds = np.array([[[0, 1], [0, 2]],
+                           [[-1, 1], [5, 6]]])
+    discretize = bf_io.ObservationDiscretizer(box, history_length=None, thresholds=thresholds)
+    self.assertFalse(discretize.is_fluid())
+    self.assertAllEqual(discretize(np.array([[0.5, 3], [-2, 5]])), [[1, 2], [0, 1]])
+
+    # The same, one feature at a time
+    discretize.feature_thresholds = None
+    self.assertAllEqual(discretize(np.array([[0.5, 3], [-2, 5]])), [[1, 2], [0, 1]])
+
+  def testSharedThresholds(self):
+    box = s.Box(low=-10, high=10, shape=(3,), dtype=np.float64)
+    discretize = bf_io.ObservationDiscretizer(box, history_length=None, thresholds=[0, 1])
+    self.assertAllEqual(discretize(np.array([-1, 0.5, 2])), [0, 1, 2])
+
+if __name__ == '__main__':
+  tf.test.main()
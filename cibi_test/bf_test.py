@@ -4,6 +4,7 @@ from __future__ import print_function
 
 """Tests for common.bf."""
 
+import numpy as np
 import tensorflow as tf
 import gym.spaces as s
 from cibi import bf  # brain coder
@@ -87,7 +88,7 @@ class BfTest(tf.test.TestCase):
         '+++.]]]]>----.[[[[[>+.',
         input_buffer=[],
         require_correct_syntax=True)
-    self.assertEqual([], agent.action_stack)
+    self.assertEqual([], list(agent.action_stack))
     self.assertEqual(bf.Result.SYNTAX_ERROR, agent.result)
 
   def testMaxSteps(self):
@@ -101,12 +102,109 @@ class BfTest(tf.test.TestCase):
     self.assertEqual([1, 0], output)
     self.assertEqual(bf.Result.SUCCESS, agent.result)
 
+  def testFusedOps(self):
+    self.assertCorrectOutput(
+        [2, 2, 3],
+        evaluate('++++--.<<<.>>+++.', debug=False))
+    self.assertCorrectOutput(
+        [1, 2],
+        evaluate('++<<>>+.<<.', debug=False))
+
+    agent = evaluate('+++++[-].', input_buffer=[], max_steps=100, debug=False)
+    self.assertEqual([0], list(agent.action_stack))
+    self.assertEqual(bf.Result.SUCCESS, agent.result)
+
+    agent = evaluate('4++++[-].', input_buffer=[], max_steps=15, debug=False)
+    self.assertEqual(bf.Result.STEP_LIMIT, agent.result)
+
+    self.assertCorrectOutput(
+        [6, 0, 6, 0],
+        evaluate('3[->++<]>.<[-].>[>+<-]>.<<.', debug=False))
+    # The target is left of cell 0, so the loop can't be fused
+    self.assertCorrectOutput(
+        [0],
+        evaluate('1[-<+>].', debug=False))
+
+    # Without ] in the language, [-] is not a loop
+    clear_alphabet = bf.make_bf_plus('+-[.')['alphabet']
+    self.assertCorrectOutput(
+        [1],
+        evaluate('++[-].', language={'alphabet': clear_alphabet},
+                 require_correct_syntax=False, debug=False))
+
+    # Braces outside of the language still match, as no-op jump targets
+    open_only = bf.make_bf_plus('+-[.')['alphabet']
+    agent = evaluate('[+]+.', language={'alphabet': open_only}, debug=False)
+    self.assertEqual(bf.Result.SUCCESS, agent.result)
+    self.assertEqual([1], list(agent.action_stack))
+    agent = evaluate('+[+.', language={'alphabet': open_only}, debug=False)
+    self.assertEqual(bf.Result.SYNTAX_ERROR, agent.result)
+
+    # Fused ops take all their steps at once, even past the step limit.
+    # The unfused code would stop with [2], [4] and [3]
+    for code, memory in [('++++.', [4]), ('4[-].', [0]), ('3[->+<].', [0, 3])]:
+      for debug in [True, False]:
+        agent = evaluate(code, max_steps=2, debug=debug)
+        self.assertEqual(bf.Result.STEP_LIMIT, agent.result)
+        self.assertEqual([], list(agent.action_stack))
+        self.assertEqual(memory, agent.memory())
+
+  def testNativeExecution(self):
+    for code in ['4[>++++<-]>[>++++<-]>[.!-]', '+.]>----.[>+.', '2^+.a~.[-]3[!-]']:
+      python_agent = evaluate(code, require_correct_syntax=False, debug=True)
+      native_agent = evaluate(code, require_correct_syntax=False, debug=False)
+      self.assertEqual(python_agent.result, native_agent.result)
+      self.assertEqual(list(python_agent.action_stack), list(native_agent.action_stack))
+      self.assertEqual(python_agent.memory(), native_agent.memory())
+
+  def testNativeRandom(self):
+    for debug in [True, False]:
+      agent = evaluate('4[>@!<-]', debug=debug)
+      self.assertEqual(bf.Result.SUCCESS, agent.result)
+      self.assertEqual(4, len(agent.action_stack))
+      self.assertTrue(all(0 <= action < bf_io.DEFAULT_STEPS for action in agent.action_stack))
+
+    # Both interpreters draw from the generator bf.seed seeds
+    traces = []
+    for debug in [True, False]:
+      bf.seed(0)
+      traces.append(list(evaluate('4[>@!<-]', debug=debug).action_stack))
+    self.assertEqual(traces[0], traces[1])
+
+  def testCodeConversion(self):
+    language = bf.make_bf_plus()
+    code = '+[>@!<-]a4'
+    indices = language['char_to_int'](code)
+    for same_code in [code, list(code), np.array(list(code))]:
+      self.assertEqual(indices, language['char_to_int'](same_code))
+    for same_indices in [indices, np.array(indices)]:
+      self.assertEqual(code, language['int_to_char'](same_indices))
+
+    # Negative indices count from the end, like in the alphabet string
+    self.assertEqual(language['alphabet'][-1], language['int_to_char']([-1]))
+    with self.assertRaises(IndexError):
+      language['int_to_char']([len(language['alphabet'])])
+    for bad_code in ['+z', '+\u00e9', ['+', '?']]:
+      with self.assertRaises(KeyError):
+        language['char_to_int'](bad_code)
+
+  def testMutationOverNumbers(self):
+    try:
+      from cibi.junior_developer import mut_with_number_arrays
+    except ImportError:
+      self.skipTest('junior developer dependencies missing')
+
+    language = bf.make_bf_plus()
+    # Mutation levers pass the code as a list of chars
+    mutate = mut_with_number_arrays(lambda language, code, indpb: [c + 1 for c in code])
+    self.assertEqual('><', mutate(language, list('@>'), 1))
+
   def testOutputMemory(self):
     agent = evaluate('+>++>+++>++++.', input_buffer=[])
     output = list(reversed(agent.action_stack))
     self.assertEqual([4], output)
     self.assertEqual(bf.Result.SUCCESS, agent.result)
-    self.assertEqual([1, 2, 3, 4], agent.cells)
+    self.assertEqual([1, 2, 3, 4], agent.memory())
 
   def testProgramTrace(self):
     es = bf.ExecutionSnapshot
@@ -140,6 +238,15 @@ class BfTest(tf.test.TestCase):
     print(discretize.thresholds)
     self.assertEqual(discretize(5.5), 1)
 
+  def testActionSampler(self):
+    sample = bf_io.ActionSampler(s.Discrete(3))
+    self.assertEqual([sample([x]) for x in [-1, 0, 2, 3, 7]], [2, 0, 2, 0, 1])
+
+    box = s.Box(low=np.array([-1, -np.inf, -np.inf, 0]), 
+                high=np.array([1, np.inf, 2, np.inf]), dtype=np.float64)
+    sample = bf_io.ActionSampler(box)
+    self.assertAllClose(sample([4, 1, 10, -12]), [1, 0.2, 1.5, 3])
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -1,5 +1,6 @@
+import os
 import tensorflow as tf
-from cibi.codebase import make_prod_codebase
+from cibi.codebase import make_prod_codebase, make_dev_codebase
 
 class CodebaseTest(tf.test.TestCase):
     def testDeduplication(self):
@@ -13,5 +14,17 @@ class CodebaseTest(tf.test.TestCase):
         self.assertEqual(codebase['code'][0], '+>+')
         self.assertEqual(codebase['total_reward'][0], 5)
 
+    def testIncompatibleSaveFile(self):
+        save_file = os.path.join(self.get_temp_dir(), 'programs.pickle')
+        dev_codebase = make_dev_codebase(save_file=save_file)
+        dev_codebase.commit('+>+', metrics={'log_prob': 0})
+        dev_codebase.flush()
+
+        # Other columns, the saved programs are kept aside
+        codebase = make_prod_codebase(deduplication=True, save_file=save_file)
+        self.assertEqual(len(codebase), 0)
+        self.assertFalse(os.path.exists(save_file))
+        self.assertEqual(len(make_dev_codebase(save_file=save_file + '.bak')), 1)
+
 if __name__ == '__main__':
   tf.test.main()
\ No newline at end of file
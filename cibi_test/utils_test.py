@@ -0,0 +1,60 @@
+import numpy as np
+import tensorflow as tf
+import gym.spaces as s
+from cibi import bf_io
+from cibi.codebase import make_prod_codebase
+from cibi.utils import ensure_enough_test_runs
+
+class CountingEnv():
+  """Rewards every action with its value, for 10 steps"""
+  observation_space = s.Discrete(4)
+  action_space = s.Discrete(3)
+
+  def seed(self, seed):
+    pass
+
+  def reset(self):
+    self.t = 0
+    return 0
+
+  def step(self, action):
+    self.t += 1
+    return self.t % 4, float(action), self.t >= 10, {}
+
+  def close(self):
+    pass
+
+def make_broken_env():
+  raise RuntimeError('No environment today')
+
+def make_codebase(programs):
+  codebase = make_prod_codebase(deduplication=True)
+  for code in programs:
+    codebase.commit(code, metrics={'total_reward': 0, 'quality': 0, 'log_prob': 0},
+                    metadata={'result': 'success', 'author': 'god', 'method': 'seed',
+                              'parent1': None, 'parent2': None}, count=0)
+  return codebase
+
+class UtilsTest(tf.test.TestCase):
+  def testTestWorkers(self):
+    programs = ['2!', '1!', '+!', '>1!']
+    observation_discretizer = bf_io.ObservationDiscretizer(CountingEnv.observation_space, history_length=None)
+    action_sampler = bf_io.ActionSampler(CountingEnv.action_space)
+
+    rewards = []
+    for workers in [1, 2]:
+      codebase = make_codebase(programs)
+      ensure_enough_test_runs(codebase, CountingEnv(), observation_discretizer, action_sampler,
+                              runs=3, workers=workers, make_env=CountingEnv)
+      self.assertEqual([3] * len(programs), codebase['count'])
+      rewards.append(codebase['total_reward'])
+    self.assertEqual(rewards[0], rewards[1])
+
+    # Workers that can't make an environment raise instead of hanging
+    with self.assertRaises(RuntimeError):
+      ensure_enough_test_runs(make_codebase(programs), CountingEnv(), 
+                              observation_discretizer, action_sampler,
+                              runs=3, workers=2, make_env=make_broken_env)
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -2,6 +2,7 @@ from setuptools import setup
 
 dependencies = [
       'numpy==1.*',
+      'numba==0.*',
       'scipy==1.*',
       'tensorflow==1.*',
       'six==1.*',